@@ -0,0 +1,122 @@
+"""
+Complexity Router for SQL Generation.
+Routes questions to the cheapest generation tier that can answer them: a fixed
+SQL template (no LLM call), a fast model, or the full model.
+"""
+
+import logging
+import re
+from enum import Enum
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class RouteTier(Enum):
+    """SQL generation tiers, cheapest first."""
+    TEMPLATE = "template"
+    FAST = "fast"
+    FULL = "full"
+
+# Date filters for the periods the templates understand
+_PERIOD_FILTERS = {
+    "today": "activity_date = CURDATE()",
+    "yesterday": "activity_date = DATE_SUB(CURDATE(), INTERVAL 1 DAY)",
+    "this week": "activity_date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)",
+    "this month": "activity_date >= DATE_FORMAT(CURDATE(), '%Y-%m-01')",
+}
+_PERIOD = r"(?P<period>today|yesterday|this week|this month)"
+
+# (pattern, table, SQL builder) for the common single-table intents; website
+# names are restricted to domain characters so they can be inlined safely
+_TEMPLATES = (
+    (
+        re.compile(r"^how much time did i spend on (?P<site>[a-z0-9-]+(?:\.[a-z0-9-]+)+) " + _PERIOD + r"\??$"),
+        "web_activity",
+        lambda m: (
+            "SELECT SUM(time_spent) as total_time FROM web_activity WHERE user_id = %s "
+            f"AND website_name = '{m.group('site')}' AND {_PERIOD_FILTERS[m.group('period')]}"
+        ),
+    ),
+    (
+        re.compile(r"^show (?:me )?my web activity (?:for )?" + _PERIOD + r"\??$"),
+        "web_activity",
+        lambda m: (
+            "SELECT * FROM web_activity WHERE user_id = %s "
+            f"AND {_PERIOD_FILTERS[m.group('period')]} ORDER BY created_at DESC"
+        ),
+    ),
+    (
+        re.compile(r"^show (?:me )?my github commits (?:for )?" + _PERIOD + r"\??$"),
+        "github_activity",
+        lambda m: (
+            "SELECT * FROM github_activity WHERE user_id = %s AND activity_type = 'commit' "
+            f"AND {_PERIOD_FILTERS[m.group('period')]} ORDER BY activity_date DESC"
+        ),
+    ),
+)
+
+# Words that indicate joins, grouping, ranking or comparisons
+_COMPLEX_WORDS_RE = re.compile(
+    r"\b(?:join|compare|comparison|versus|vs|each|per|group|grouped|average|avg|trend|rank|ranking|"
+    r"top|most|least|both|between|breakdown|distribution|percentage|ratio|overall|across)\b"
+)
+
+class ComplexityRouter:
+    """Scores question complexity and picks a SQL generation tier."""
+
+    def __init__(self, fast_threshold: int = 3, table_exists: Callable[[str], bool] = None):
+        """Initialize the router.
+
+        Args:
+            fast_threshold: Highest complexity score routed to the fast model
+            table_exists: Check that a template's table exists (templates are skipped if None)
+        """
+        self.fast_threshold = fast_threshold
+        self.table_exists = table_exists
+
+    def route(self, question: str, matched_tables: int = 1) -> Tuple[RouteTier, int, Optional[str]]:
+        """Pick the generation tier for a question.
+
+        Args:
+            question: User's natural language question
+            matched_tables: Number of schema tables the question refers to
+
+        Returns:
+            Tuple of (tier, complexity score, SQL query for the template tier or None)
+        """
+        normalized = " ".join(question.lower().split())
+
+        sql_query = self._match_template(normalized)
+        if sql_query:
+            return RouteTier.TEMPLATE, 0, sql_query
+
+        score = self.score(normalized, matched_tables)
+        tier = RouteTier.FAST if score <= self.fast_threshold else RouteTier.FULL
+        return tier, score, None
+
+    def score(self, question: str, matched_tables: int = 1) -> int:
+        """Score question complexity from length, complexity keywords and tables involved.
+
+        Args:
+            question: Lowercased question
+            matched_tables: Number of schema tables the question refers to
+
+        Returns:
+            Complexity score (higher is more complex)
+        """
+        score = len(question.split()) // 8
+        score += 2 * len(_COMPLEX_WORDS_RE.findall(question))
+        score += 3 * max(matched_tables - 1, 0)
+        return score
+
+    def _match_template(self, question: str) -> Optional[str]:
+        """Build SQL from a template matching the question, if any."""
+        if self.table_exists is None:
+            return None
+
+        for pattern, table, build_sql in _TEMPLATES:
+            match = pattern.match(question)
+            if match and self.table_exists(table):
+                return build_sql(match)
+
+        return None
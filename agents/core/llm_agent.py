@@ -5,8 +5,10 @@ Enhanced orchestration system with specialized agents for different tasks.
 
 import os
 import json
+import asyncio
 import logging
-from typing import Dict, Any, Optional, Tuple
+import random
+from typing import Dict, Any, Optional
 from datetime import datetime
 
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -15,23 +17,37 @@ from langchain_core.prompts import PromptTemplate
 from langsmith import traceable
 
 from agents.core.sql_agent import SQLGenerationAgent
+from agents.core.sql_batcher import SQLGenerationBatcher
 from agents.core.query_execution_agent import QueryExecutionAgent
 from agents.core.response_formatting_agent import ResponseFormattingAgent
 from agents.core.schema_agent import SchemaAwarenessAgent
-from agents.guards.security_guards import QuerySecurityGuard, ResponseSecurityGuard
+from agents.core.query_cache import SemanticQueryCache
+from agents.core.prompt_manager import PromptManager
+from agents.guards.security_guards import ResponseSecurityGuard, get_query_guard
 from agents.schemas import AgentResponse
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 class LLMDatabaseAgent:
     """LLM-powered database agent for natural language queries."""
     
-    def __init__(self, gemini_api_key: str, model_name: str = "models/gemini-2.5-pro"):
+    _CAPABILITIES = (
+        "Natural language to SQL conversion",
+        "Safe query execution",
+        "Response formatting",
+        "Database schema awareness",
+        "Multi-agent orchestration"
+    )
+    
+    def __init__(self, gemini_api_key: str, model_name: str = "models/gemini-2.5-pro",
+                 enable_semantic_cache: bool = Config.SEMANTIC_CACHE_ENABLED):
         """Initialize the LLM database agent with specialized agents.
         
         Args:
             gemini_api_key: Google Gemini API key
             model_name: Gemini model name
+            enable_semantic_cache: Serve semantically identical questions from cache
         """
         self.gemini_api_key = gemini_api_key
         self.model_name = model_name
@@ -42,14 +58,42 @@ class LLMDatabaseAgent:
         self.query_execution_agent = QueryExecutionAgent()
         self.response_formatting_agent = ResponseFormattingAgent(gemini_api_key, model_name)
         
-        # Initialize security guards
-        self.query_guard = QuerySecurityGuard()
+        # Initialize prompt manager for validation prompts
+        self.prompt_manager = PromptManager()
+        
+        # Initialize security guards (query guard is shared with the execution agent)
+        self.query_guard = get_query_guard()
         self.response_guard = ResponseSecurityGuard()
         
+        # Initialize semantic response cache (disabled for correctness-sensitive deployments)
+        self.semantic_cache = None
+        if enable_semantic_cache:
+            self.semantic_cache = SemanticQueryCache(
+                gemini_api_key,
+                embedding_model=Config.EMBEDDING_MODEL,
+                similarity_threshold=Config.SEMANTIC_CACHE_THRESHOLD,
+                ttl_seconds=Config.SEMANTIC_CACHE_TTL
+            )
+            # Cached responses are stale once the schema they were built on changes
+            for schema_agent in (self.schema_agent, self.sql_agent.schema_agent):
+                schema_agent.add_schema_change_listener(self.semantic_cache.invalidate)
+        
+        # Micro-batch concurrent SQL generation in the async path
+        self.sql_batcher = None
+        if Config.SQL_BATCHING_ENABLED:
+            self.sql_batcher = SQLGenerationBatcher(
+                self.sql_agent,
+                max_batch_size=Config.SQL_BATCH_MAX_SIZE,
+                max_wait_ms=Config.SQL_BATCH_MAX_WAIT_MS
+            )
+        
+        # Static part of get_agent_info, built on first use
+        self._agent_info_cache: Optional[Dict[str, Any]] = None
+        
         # Initialize main LLM for orchestration
         self._setup_llm()
         
-        logger.info(f"LLMDatabaseAgent initialized with model: {model_name}")
+        logger.info("LLMDatabaseAgent initialized with model: %s", model_name)
         logger.info("Specialized agents: Schema, SQL Generation, Query Execution, Response Formatting")
     
     def _setup_llm(self):
@@ -66,15 +110,26 @@ class LLMDatabaseAgent:
             )
             self.parser = StrOutputParser()
             
+            # Build the validation chain once; only sql_query varies per call
+            validation_prompt = PromptTemplate(
+                template=self.prompt_manager.get_query_validation_template(),
+                input_variables=["sql_query"],
+                template_format="jinja2"
+            )
+            self._validate_chain = validation_prompt | self.model | self.parser
+            
             logger.info("Google Gemini LLM setup completed successfully")
         except Exception as e:
-            logger.error(f"Failed to setup Google Gemini LLM: {e}")
+            logger.error("Failed to setup Google Gemini LLM: %s", e)
             raise
     
     @traceable(name="process_question", project_name="web-activity-agent-system")
     def process_question(self, question: str, user_id: int) -> Dict[str, Any]:
         """Process a natural language question using specialized agents.
         
+        No database connection is held during the LLM calls (SQL generation and
+        response formatting); the connection is only open inside query execution.
+        
         Args:
             question: User's natural language question
             user_id: User ID for database filtering
@@ -83,72 +138,193 @@ class LLMDatabaseAgent:
             Dictionary containing response and metadata
         """
         try:
-            logger.info(f"Processing question for user {user_id}: {question}")
+            logger.info("Processing question for user %s: %s", user_id, question)
+            
+            # Step 0: Serve semantically identical questions from cache
+            question_embedding = None
+            if self.semantic_cache:
+                question_embedding = self.semantic_cache.embed_question(question)
+                cached_response = self._lookup_cached_response(question, user_id, question_embedding)
+                if cached_response:
+                    return cached_response
             
             # Step 1: Generate SQL query using SQL Generation Agent
+            self._assert_no_db_connection_held()
             sql_query = self._generate_sql_query(question, user_id)
             if not sql_query:
-                return {
-                    "success": False,
-                    "error": "Failed to generate SQL query",
-                    "response": self.response_formatting_agent.format_error_response(
-                        question, "SQL generation failed", "sql"
-                    )
-                }
+                return self._sql_failure_response(question)
             
             # Step 2: Execute query using Query Execution Agent
             query_results = self.query_execution_agent.execute_query(sql_query, user_id)
             if not query_results["success"]:
-                return {
-                    "success": False,
-                    "error": query_results["error"],
-                    "response": self.response_formatting_agent.format_error_response(
-                        question, query_results["error"], "database"
-                    )
-                }
+                return self._execution_failure_response(question, query_results)
             
             # Step 3: Format response using Response Formatting Agent
-            if query_results["row_count"] == 0:
-                formatted_response = self.response_formatting_agent.format_empty_results_response(question)
-                structured_response = {
-                    "response": formatted_response,
-                    "results": [],
-                    "summary": {},
-                    "metadata": {}
-                }
+            structured_response = self._format_query_results(question, query_results, sql_query)
+            
+            return self._build_final_response(
+                question, user_id, sql_query, query_results, structured_response, question_embedding
+            )
+            
+        except Exception as e:
+            logger.error("Error processing question: %s", e)
+            return self._general_failure_response(question, e)
+    
+    @traceable(name="process_question_async", project_name="web-activity-agent-system")
+    async def aprocess_question(self, question: str, user_id: int) -> Dict[str, Any]:
+        """Async variant of process_question for async web frameworks.
+        
+        The semantic cache lookup and SQL generation are started together; a cache
+        hit cancels the in-flight SQL generation call. With SQL batching enabled,
+        concurrent questions share a single SQL generation call. Blocking database and
+        formatting work runs in worker threads so the event loop stays free.
+        
+        Args:
+            question: User's natural language question
+            user_id: User ID for database filtering
+            
+        Returns:
+            Dictionary containing response and metadata
+        """
+        sql_task = None
+        try:
+            logger.info("Processing question for user %s: %s", user_id, question)
+            
+            # Steps 0 and 1 run concurrently: cache lookup alongside SQL generation
+            current_date = datetime.now().strftime('%Y-%m-%d')
+            if self.sql_batcher:
+                sql_coro = self.sql_batcher.submit(question, user_id, current_date)
             else:
-                structured_response = self.response_formatting_agent.format_response(
-                    question, query_results, sql_query
-                )
-            
-            if not structured_response or not structured_response.get("response"):
-                return {
-                    "success": False,
-                    "error": "Failed to format response",
-                    "response": "I found the data but couldn't format a proper response.",
-                    "results": []
-                }
-            
-            logger.info(f"Successfully processed question for user {user_id}")
-            return {
-                "success": True,
-                "response": structured_response["response"],
-                "results": structured_response["results"],
-                "sql_query": sql_query,
-                "user_id": user_id,
-                "timestamp": datetime.now().isoformat(),
-                "agents_used": ["SQL Generation", "Query Execution", "Response Formatting"]
-            }
+                sql_coro = self.sql_agent.agenerate_sql_query(question, user_id, current_date)
+            sql_task = asyncio.create_task(sql_coro)
+            
+            question_embedding = None
+            if self.semantic_cache:
+                question_embedding = await self.semantic_cache.aembed_question(question)
+                cached_response = self._lookup_cached_response(question, user_id, question_embedding)
+                if cached_response:
+                    return cached_response
+            
+            sql_query = await sql_task
+            if not sql_query:
+                logger.warning("SQL agent failed to generate query")
+                return self._sql_failure_response(question)
+            
+            # Step 2: Execute query using Query Execution Agent
+            query_results = await asyncio.to_thread(
+                self.query_execution_agent.execute_query, sql_query, user_id
+            )
+            if not query_results["success"]:
+                return self._execution_failure_response(question, query_results)
+            
+            # Step 3: Format response using Response Formatting Agent
+            structured_response = await asyncio.to_thread(
+                self._format_query_results, question, query_results, sql_query
+            )
+            
+            return self._build_final_response(
+                question, user_id, sql_query, query_results, structured_response, question_embedding
+            )
             
         except Exception as e:
-            logger.error(f"Error processing question: {e}")
+            logger.error("Error processing question: %s", e)
+            return self._general_failure_response(question, e)
+        finally:
+            # Cancels SQL generation on cache hits and on errors
+            if sql_task and not sql_task.done():
+                sql_task.cancel()
+    
+    def _lookup_cached_response(self, question: str, user_id: int,
+                                question_embedding: Optional[list]) -> Optional[Dict[str, Any]]:
+        """Look up a cached response for a question, marking it as a cache hit."""
+        if question_embedding is None:
+            return None
+        
+        cached_response = self.semantic_cache.lookup(question, user_id, question_embedding)
+        if cached_response:
+            cached_response["timestamp"] = datetime.now().isoformat()
+            cached_response["cache_hit"] = True
+        return cached_response
+    
+    def _format_query_results(self, question: str, query_results: Dict[str, Any], sql_query: str) -> Dict[str, Any]:
+        """Format successful query results into a structured response."""
+        self._assert_no_db_connection_held()
+        
+        if query_results["row_count"] == 0:
+            formatted_response = self.response_formatting_agent.format_empty_results_response(question)
+            return {
+                "response": formatted_response,
+                "results": [],
+                "summary": {},
+                "metadata": {}
+            }
+        
+        return self.response_formatting_agent.format_response(question, query_results, sql_query)
+    
+    def _assert_no_db_connection_held(self):
+        """Debug check that no database connection is held across an LLM call."""
+        assert not self.query_execution_agent.db_manager.has_open_connection(), \
+            "Database connection must not be held during LLM calls"
+    
+    def _build_final_response(self, question: str, user_id: int, sql_query: str,
+                              query_results: Dict[str, Any], structured_response: Dict[str, Any],
+                              question_embedding: Optional[list]) -> Dict[str, Any]:
+        """Build the final response dictionary and populate the semantic cache."""
+        if not structured_response or not structured_response.get("response"):
             return {
                 "success": False,
-                "error": str(e),
-                "response": self.response_formatting_agent.format_error_response(
-                    question, str(e), "general"
-                )
+                "error": "Failed to format response",
+                "response": "I found the data but couldn't format a proper response.",
+                "results": []
             }
+        
+        logger.info("Successfully processed question for user %s", user_id)
+        response = {
+            "success": True,
+            "response": structured_response["response"],
+            "results": structured_response["results"],
+            "sql_query": sql_query,
+            "user_id": user_id,
+            "timestamp": datetime.now().isoformat(),
+            "agents_used": ["SQL Generation", "Query Execution", "Response Formatting"]
+        }
+        
+        # Cache the response (modification requests are never cached)
+        if (self.semantic_cache and question_embedding is not None
+                and not query_results.get("is_modification_request")):
+            self.semantic_cache.store(question, user_id, response, question_embedding)
+        
+        return response
+    
+    def _sql_failure_response(self, question: str) -> Dict[str, Any]:
+        """Build the response returned when SQL generation fails."""
+        return {
+            "success": False,
+            "error": "Failed to generate SQL query",
+            "response": self.response_formatting_agent.format_error_response(
+                question, "SQL generation failed", "sql"
+            )
+        }
+    
+    def _execution_failure_response(self, question: str, query_results: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the response returned when query execution fails."""
+        return {
+            "success": False,
+            "error": query_results["error"],
+            "response": self.response_formatting_agent.format_error_response(
+                question, query_results["error"], "database"
+            )
+        }
+    
+    def _general_failure_response(self, question: str, error: Exception) -> Dict[str, Any]:
+        """Build the response returned on unexpected errors."""
+        return {
+            "success": False,
+            "error": str(error),
+            "response": self.response_formatting_agent.format_error_response(
+                question, str(error), "general"
+            )
+        }
     
     @traceable(name="generate_sql_query", project_name="web-activity-agent-system")
     def _generate_sql_query(self, question: str, user_id: int) -> Optional[str]:
@@ -158,58 +334,104 @@ class LLMDatabaseAgent:
             sql_query = self.sql_agent.generate_sql_query(question, user_id, current_date)
             
             if sql_query:
-                logger.debug(f"Generated SQL query: {sql_query}")
+                logger.debug("Generated SQL query: %s", sql_query)
                 return sql_query
             else:
                 logger.warning("SQL agent failed to generate query")
                 return None
                 
         except Exception as e:
-            logger.error(f"Error generating SQL query: {e}")
+            logger.error("Error generating SQL query: %s", e)
             return None
     
-    def validate_query_with_llm(self, sql_query: str) -> bool:
-        """Use LLM to validate SQL query (additional security layer)."""
-        try:
-            # Render validation prompt
-            prompt_text = self.prompt_manager.render_query_validation_prompt(sql_query)
-            
-            # Create prompt template
-            prompt = PromptTemplate(
-                template=prompt_text,
-                input_variables=[]
-            )
+    def validate_query_with_llm(self, sql_query: str, deep_audit: Optional[bool] = None) -> bool:
+        """Validate SQL query (additional security layer).
+        
+        The query guard's compiled pattern scan decides; a sampled share of queries
+        that pass the scan is additionally audited by the LLM.
+        
+        Args:
+            sql_query: SQL query to validate
+            deep_audit: Force (True) or skip (False) the LLM audit; sampled when None
             
-            # Get validation response
-            response = (prompt | self.model | self.parser).invoke({})
+        Returns:
+            True if the query is considered safe
+        """
+        if not self.query_guard.scan_query(sql_query):
+            return False
+        
+        if deep_audit is None:
+            deep_audit = random.random() < Config.LLM_DEEP_AUDIT_RATE
+        
+        if deep_audit:
+            return self._audit_query_with_llm(sql_query)
+        
+        return True
+    
+    def _audit_query_with_llm(self, sql_query: str) -> bool:
+        """Use LLM to audit a SQL query for safety."""
+        try:
+            # Stream the validation response and stop as soon as a verdict appears;
+            # the rest of the stream is discarded
+            response = ""
+            for chunk in self._validate_chain.stream({"sql_query": sql_query}):
+                response += chunk
+                response_upper = response.upper()
+                
+                # Check UNSAFE first since it contains SAFE
+                if "UNSAFE" in response_upper:
+                    return False
+                if "SAFE" in response_upper:
+                    return True
             
-            # Check if LLM says query is safe
-            return "SAFE" in response.upper()
+            logger.warning("LLM query validation returned no verdict: %s", response)
+            return False
             
         except Exception as e:
-            logger.error(f"Error in LLM query validation: {e}")
+            logger.error("Error in LLM query validation: %s", e)
             return False
     
-    def get_agent_info(self) -> Dict[str, Any]:
-        """Get information about the agent and all specialized agents."""
+    def refresh_schema(self) -> Dict[str, Any]:
+        """Re-read the database schema and drop schema-derived caches.
+        
+        Returns:
+            Dictionary with the number of tables and the new schema version
+        """
+        self.sql_agent.invalidate_schema_cache()
+        schema = self.sql_agent.schema_agent.get_database_schema(force_refresh=True)
+        self.schema_agent.get_database_schema(force_refresh=True)
+        
         return {
-            "main_agent": {
-                "model_name": self.model_name,
-                "status": "active",
-                "type": "LLM Database Orchestrator"
-            },
-            "specialized_agents": {
-                "schema_agent": self.schema_agent.get_agent_info(),
+            "tables": len(schema),
+            "schema_version": self.sql_agent.schema_agent.schema_version()
+        }
+    
+    def get_agent_info(self) -> Dict[str, Any]:
+        """Get information about the agent and all specialized agents.
+        
+        The static metadata is assembled once; only the sub-agents reporting
+        live state (cache counters, schema cache size, database connectivity)
+        are refreshed.
+        """
+        if self._agent_info_cache is None:
+            self._agent_info_cache = {
+                "main_agent": {
+                    "model_name": self.model_name,
+                    "status": "active",
+                    "type": "LLM Database Orchestrator"
+                },
+                "specialized_agents": {
+                    "response_formatting_agent": self.response_formatting_agent.get_agent_info()
+                },
+                "security_level": self.query_guard.security_level.value,
+                "capabilities": self._CAPABILITIES
+            }
+        
+        info = self._agent_info_cache
+        return info | {
+            "specialized_agents": info["specialized_agents"] | {
                 "sql_generation_agent": self.sql_agent.get_agent_info(),
-                "query_execution_agent": self.query_execution_agent.get_agent_info(),
-                "response_formatting_agent": self.response_formatting_agent.get_agent_info()
-            },
-            "security_level": self.query_guard.security_level.value,
-            "capabilities": [
-                "Natural language to SQL conversion",
-                "Safe query execution",
-                "Response formatting",
-                "Database schema awareness",
-                "Multi-agent orchestration"
-            ]
+                "schema_agent": self.schema_agent.get_agent_info(),
+                "query_execution_agent": self.query_execution_agent.get_agent_info()
+            }
         }
@@ -124,6 +124,15 @@ class PromptManager:
         
         return template.render(**context)
     
+    def get_query_validation_template(self) -> str:
+        """Get the unrendered query validation template source.
+        
+        Returns:
+            Jinja2 source of the query validation template
+        """
+        source, _, _ = self.env.loader.get_source(self.env, "query_validation.j2")
+        return source
+    
     def render_query_execution_validation_prompt(self, sql_query: str) -> str:
         """Render the query execution validation prompt.
         
@@ -0,0 +1,479 @@
+"""
+Query Cache for LLM Agent System.
+Semantic caching of processed questions so repeated or paraphrased questions
+skip SQL generation, query execution and response formatting entirely, and of
+generated SQL so paraphrased questions skip only the SQL generation call.
+Generated SQL can also be shared across processes through Redis.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+logger = logging.getLogger(__name__)
+
+class _EmbeddingCache:
+    """Base class for caches keyed by question embeddings."""
+
+    # Maximum number of texts per batch embedding request
+    EMBED_BATCH_SIZE = 100
+
+    def __init__(self, gemini_api_key: str, embedding_model: str, similarity_threshold: float,
+                 ttl_seconds: int, max_entries_per_user: int):
+        """Initialize the embedding model and per-user entry storage.
+
+        Args:
+            gemini_api_key: Google Gemini API key used for embeddings
+            embedding_model: Gemini embedding model name
+            similarity_threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Lifetime of a cached entry in seconds
+            max_entries_per_user: Maximum number of cached entries kept per user
+        """
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_user = max_entries_per_user
+
+        self.embeddings = GoogleGenerativeAIEmbeddings(
+            model=embedding_model,
+            google_api_key=gemini_api_key
+        )
+
+        # user_id -> list of entry dicts, each with "embedding" and "created_at"
+        self._entries: Dict[int, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def embed_question(self, question: str) -> Optional[List[float]]:
+        """Compute an L2-normalized embedding for a question.
+
+        Args:
+            question: User's natural language question
+
+        Returns:
+            Normalized embedding vector, or None if embedding failed
+        """
+        try:
+            vector = self.embeddings.embed_query(self._normalize_question(question))
+            return self._normalize_vector(vector)
+        except Exception as e:
+            logger.warning(f"Failed to embed question for semantic cache: {e}")
+            return None
+
+    async def aembed_question(self, question: str) -> Optional[List[float]]:
+        """Async variant of embed_question.
+
+        Args:
+            question: User's natural language question
+
+        Returns:
+            Normalized embedding vector, or None if embedding failed
+        """
+        try:
+            vector = await self.embeddings.aembed_query(self._normalize_question(question))
+            return self._normalize_vector(vector)
+        except Exception as e:
+            logger.warning(f"Failed to embed question for semantic cache: {e}")
+            return None
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """Invalidate cached entries.
+
+        Args:
+            user_id: Only invalidate this user's entries (all users if None)
+        """
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+        logger.info(f"{type(self).__name__} invalidated for {'all users' if user_id is None else f'user {user_id}'}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics."""
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+    def _best_match(self, user_id: int, embedding: List[float],
+                    matches: Callable[[Dict[str, Any]], bool] = None) -> Tuple[Optional[Dict[str, Any]], float]:
+        """Find the most similar unexpired entry above the threshold (lock must be held).
+
+        Args:
+            user_id: User whose entries are searched
+            embedding: Normalized query embedding
+            matches: Optional predicate an entry must satisfy to be considered
+
+        Returns:
+            Tuple of (best entry or None, its similarity)
+        """
+        best_entry = None
+        best_score = self.similarity_threshold
+
+        for entry in self._evict_expired(user_id):
+            if matches is not None and not matches(entry):
+                continue
+            score = sum(a * b for a, b in zip(embedding, entry["embedding"]))
+            if score >= best_score:
+                best_entry, best_score = entry, score
+
+        return best_entry, best_score
+
+    def _append_entry(self, user_id: int, entry: Dict[str, Any]):
+        """Append an entry for a user, dropping the oldest beyond the limit (lock must be held)."""
+        entries = self._evict_expired(user_id)
+        entries.append(entry)
+
+        if len(entries) > self.max_entries_per_user:
+            del entries[:len(entries) - self.max_entries_per_user]
+
+    def _evict_expired(self, user_id: int) -> List[Dict[str, Any]]:
+        """Drop expired entries for a user and return the remaining list (lock must be held)."""
+        cutoff = time.monotonic() - self.ttl_seconds
+        entries = [entry for entry in self._entries.get(user_id, []) if entry["created_at"] >= cutoff]
+        self._entries[user_id] = entries
+        return entries
+
+    @staticmethod
+    def _normalize_question(question: str) -> str:
+        """Normalize a question before embedding."""
+        return " ".join(question.lower().split())
+
+    @staticmethod
+    def _normalize_vector(vector: List[float]) -> List[float]:
+        """L2-normalize a vector so a dot product equals cosine similarity."""
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            return list(vector)
+        return [value / norm for value in vector]
+
+class SemanticQueryCache(_EmbeddingCache):
+    """Per-user semantic cache of formatted agent responses."""
+
+    def __init__(self, gemini_api_key: str, embedding_model: str = "models/text-embedding-004",
+                 similarity_threshold: float = 0.95, ttl_seconds: int = 3600,
+                 max_entries_per_user: int = 128):
+        """Initialize the semantic query cache.
+
+        Args:
+            gemini_api_key: Google Gemini API key used for embeddings
+            embedding_model: Gemini embedding model name
+            similarity_threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Lifetime of a cached entry in seconds
+            max_entries_per_user: Maximum number of cached entries kept per user
+        """
+        super().__init__(gemini_api_key, embedding_model, similarity_threshold,
+                         ttl_seconds, max_entries_per_user)
+
+        logger.info(f"SemanticQueryCache initialized (threshold={similarity_threshold}, ttl={ttl_seconds}s)")
+
+    def lookup(self, question: str, user_id: int, embedding: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        """Find a cached response for a semantically similar question.
+
+        Args:
+            question: User's natural language question
+            user_id: User ID the cached response belongs to
+            embedding: Precomputed normalized embedding (optional)
+
+        Returns:
+            Cached response dictionary, or None on a cache miss
+        """
+        if embedding is None:
+            embedding = self.embed_question(question)
+        if embedding is None:
+            return None
+
+        with self._lock:
+            best_entry, best_score = self._best_match(user_id, embedding)
+
+        if best_entry is None:
+            logger.debug(f"Semantic cache miss for user {user_id}")
+            return None
+
+        logger.info(f"Semantic cache hit for user {user_id} (similarity={best_score:.3f}): {best_entry['question']}")
+        return dict(best_entry["response"])
+
+    def store(self, question: str, user_id: int, response: Dict[str, Any],
+              embedding: Optional[List[float]] = None):
+        """Store a formatted response for a question.
+
+        Args:
+            question: User's natural language question
+            user_id: User ID the response belongs to
+            response: Response dictionary to cache
+            embedding: Precomputed normalized embedding (optional)
+        """
+        if embedding is None:
+            embedding = self.embed_question(question)
+        if embedding is None:
+            return
+
+        with self._lock:
+            self._append_entry(user_id, {
+                "question": question,
+                "embedding": embedding,
+                "response": dict(response),
+                "created_at": time.monotonic()
+            })
+
+    def warmup(self, user_id: int, entries: Sequence[Tuple[str, Dict[str, Any]]]) -> int:
+        """Pre-populate the cache with known question/response pairs.
+
+        Questions are embedded in batches of EMBED_BATCH_SIZE, one embedding
+        request per batch instead of one per question.
+
+        Args:
+            user_id: User ID the responses belong to
+            entries: (question, response) pairs to cache
+
+        Returns:
+            Number of entries stored
+        """
+        stored = 0
+        for start in range(0, len(entries), self.EMBED_BATCH_SIZE):
+            batch = entries[start:start + self.EMBED_BATCH_SIZE]
+            try:
+                vectors = self.embeddings.embed_documents(
+                    [self._normalize_question(question) for question, _ in batch]
+                )
+            except Exception as e:
+                logger.warning(f"Failed to embed warmup batch for semantic cache: {e}")
+                continue
+
+            for (question, response), vector in zip(batch, vectors):
+                self.store(question, user_id, response, embedding=self._normalize_vector(vector))
+                stored += 1
+
+        logger.info(f"Semantic cache warmed up with {stored} entries for user {user_id}")
+        return stored
+
+
+class SemanticSQLCache(_EmbeddingCache):
+    """Per-user semantic cache of generated SQL queries.
+
+    Generated SQL uses a %s placeholder for user_id and SQL generation runs at
+    temperature 0, so the SQL for a paraphrased question can be reused as long
+    as the schema and the date it was generated for are unchanged.
+    """
+
+    # Number of stores between writes of the cache to persist_path
+    PERSIST_EVERY = 25
+
+    def __init__(self, gemini_api_key: str, embedding_model: str = "models/text-embedding-004",
+                 similarity_threshold: float = 0.93, ttl_seconds: int = 3600,
+                 max_entries_per_user: int = 256, persist_path: Optional[str] = None):
+        """Initialize the semantic SQL cache.
+
+        Args:
+            gemini_api_key: Google Gemini API key used for embeddings
+            embedding_model: Gemini embedding model name
+            similarity_threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Lifetime of a cached entry in seconds
+            max_entries_per_user: Maximum number of cached entries kept per user
+            persist_path: JSON file the cache is loaded from and periodically saved to (optional)
+        """
+        super().__init__(gemini_api_key, embedding_model, similarity_threshold,
+                         ttl_seconds, max_entries_per_user)
+        self.persist_path = persist_path
+        self._stores_since_save = 0
+
+        if persist_path and os.path.exists(persist_path):
+            self.load(persist_path)
+
+        logger.info(f"SemanticSQLCache initialized (threshold={similarity_threshold}, ttl={ttl_seconds}s)")
+
+    def lookup(self, embedding: List[float], user_id: int, schema_digest: str,
+               current_date: str) -> Optional[str]:
+        """Find cached SQL for a semantically similar question.
+
+        Args:
+            embedding: Normalized question embedding
+            user_id: User ID the SQL was generated for
+            schema_digest: Digest of the schema text the SQL must have been generated against
+            current_date: Date the SQL must have been generated for
+
+        Returns:
+            Cached SQL query, or None on a cache miss
+        """
+        with self._lock:
+            best_entry, best_score = self._best_match(
+                user_id, embedding,
+                # Entries persisted by older versions carry no digest and never match
+                lambda entry: entry.get("schema_digest") == schema_digest and entry["current_date"] == current_date
+            )
+
+        if best_entry is None:
+            return None
+
+        logger.info(f"Semantic SQL cache hit for user {user_id} (similarity={best_score:.3f}): {best_entry['question']}")
+        return best_entry["sql_query"]
+
+    def store(self, embedding: List[float], question: str, user_id: int, sql_query: str,
+              schema_digest: str, current_date: str):
+        """Store generated SQL for a question.
+
+        Args:
+            embedding: Normalized question embedding
+            question: User's natural language question
+            user_id: User ID the SQL was generated for
+            sql_query: Validated SQL query
+            schema_digest: Digest of the schema text the SQL was generated against
+            current_date: Date the SQL was generated for
+        """
+        with self._lock:
+            self._append_entry(user_id, {
+                "question": question,
+                "embedding": embedding,
+                "sql_query": sql_query,
+                "schema_digest": schema_digest,
+                "current_date": current_date,
+                "created_at": time.monotonic()
+            })
+            self._stores_since_save += 1
+            should_save = self.persist_path and self._stores_since_save >= self.PERSIST_EVERY
+
+        if should_save:
+            self.save(self.persist_path)
+
+    def save(self, path: str):
+        """Write unexpired entries to a JSON file.
+
+        Args:
+            path: Destination file path
+        """
+        now = time.monotonic()
+        with self._lock:
+            data = {
+                str(user_id): [
+                    {**entry, "age": now - entry["created_at"]}
+                    for entry in self._evict_expired(user_id)
+                ]
+                for user_id in list(self._entries)
+            }
+            self._stores_since_save = 0
+
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+            logger.debug(f"Semantic SQL cache saved to {path}")
+        except Exception as e:
+            logger.warning(f"Failed to save semantic SQL cache to {path}: {e}")
+
+    def load(self, path: str):
+        """Load entries previously written by save.
+
+        Args:
+            path: Source file path
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load semantic SQL cache from {path}: {e}")
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            for user_id, entries in data.items():
+                for entry in entries:
+                    entry["created_at"] = now - entry.pop("age", 0)
+                self._entries[int(user_id)] = entries[-self.max_entries_per_user:]
+
+        logger.info(f"Semantic SQL cache loaded from {path}")
+
+
+class SharedSQLCache:
+    """Redis-backed exact-match cache of generated SQL shared across workers.
+
+    Only user-agnostic SQL (user_id passed as a %s parameter) is stored, so the
+    keys omit the user and one user's question warms the cache for everyone.
+    The redis package is optional; without it, or without a reachable server,
+    the cache stays disabled and every call is a no-op.
+    """
+
+    KEY_PREFIX = "sql:exact"
+
+    def __init__(self, redis_url: str, ttl_seconds: int = 86400):
+        """Connect to Redis.
+
+        Args:
+            redis_url: Redis connection URL (e.g. redis://localhost:6379/0)
+            ttl_seconds: Lifetime of a cached query in seconds
+        """
+        self.ttl_seconds = ttl_seconds
+        self._client = None
+
+        try:
+            import redis
+
+            client = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            client.ping()
+            self._client = client
+            logger.info(f"SharedSQLCache connected (ttl={ttl_seconds}s)")
+        except ImportError:
+            logger.warning("redis package not installed; shared SQL cache disabled")
+        except Exception as e:
+            logger.warning(f"Failed to connect to Redis; shared SQL cache disabled: {e}")
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache is connected."""
+        return self._client is not None
+
+    def get(self, normalized_question: str, schema_digest: str, current_date: str) -> Optional[str]:
+        """Look up shared SQL for a normalized question.
+
+        Args:
+            normalized_question: Question normalized for exact matching
+            schema_digest: Digest of the schema text the SQL must have been generated against
+            current_date: Date the SQL must have been generated for
+
+        Returns:
+            Cached SQL query, or None on a miss or Redis error
+        """
+        if self._client is None:
+            return None
+
+        try:
+            value = self._client.get(self._key(normalized_question, schema_digest, current_date))
+        except Exception as e:
+            logger.warning(f"Shared SQL cache lookup failed: {e}")
+            return None
+
+        return value.decode() if value is not None else None
+
+    def set(self, normalized_question: str, schema_digest: str, current_date: str, sql_query: str):
+        """Store user-agnostic SQL for a normalized question.
+
+        Args:
+            normalized_question: Question normalized for exact matching
+            schema_digest: Digest of the schema text the SQL was generated against
+            current_date: Date the SQL was generated for
+            sql_query: Validated SQL query with a %s user_id placeholder
+        """
+        if self._client is None:
+            return
+
+        try:
+            self._client.set(self._key(normalized_question, schema_digest, current_date),
+                             sql_query, ex=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Shared SQL cache store failed: {e}")
+
+    def _key(self, normalized_question: str, schema_digest: str, current_date: str) -> str:
+        """Build the Redis key for a question."""
+        digest = hashlib.sha256(normalized_question.encode()).hexdigest()
+        return f"{self.KEY_PREFIX}:{schema_digest}:{current_date}:{digest}"
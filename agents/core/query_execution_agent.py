@@ -6,60 +6,155 @@ Specialized agent for safely executing SQL queries and handling database operati
 import json
 import logging
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, Any, Optional, List, Tuple
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 
-from backend.database.db_manager import DatabaseManager
-from agents.guards.security_guards import QuerySecurityGuard
+import orjson
+
+from backend.database.db_manager import get_db_manager
+from agents.guards.security_guards import get_query_guard
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns for query syntax checks and parameter preparation
+_DANGEROUS_KEYWORDS = ('DROP', 'DELETE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE', 'TRUNCATE')
+_SYNTAX_TOKEN_RE = re.compile(
+    r'\b(SELECT|FROM|WHERE|USER_ID|' + '|'.join(_DANGEROUS_KEYWORDS) + r')\b',
+    re.IGNORECASE
+)
+# Matches a string literal (possibly unterminated) or a %s placeholder outside literals
+_PARAM_TOKEN_RE = re.compile(r"'[^']*'?|%s")
+
+@lru_cache(maxsize=256)
+def _scan_sql(sql_query: str) -> Tuple[bool, bool, bool, bool, Tuple[str, ...]]:
+    """Scan a query once for syntax features and dangerous keywords.
+    
+    Memoized since audit loops and statistics calls re-check the same queries.
+    
+    Returns:
+        Tuple of (has_select, has_from, has_where, has_user_id, dangerous_keywords)
+    """
+    tokens = {match.upper() for match in _SYNTAX_TOKEN_RE.findall(sql_query)}
+    return (
+        sql_query.lstrip()[:6].upper() == 'SELECT',
+        'FROM' in tokens,
+        'WHERE' in tokens,
+        'USER_ID' in tokens,
+        tuple(kw for kw in _DANGEROUS_KEYWORDS if kw in tokens)
+    )
+
+@lru_cache(maxsize=1024)
+def _compile_query_template(sql_query: str) -> Tuple[str, int]:
+    """Compile a query template into its executable form.
+    
+    Placeholder positions depend only on the template, so repeated query
+    shapes skip the rewrite and only rebind user_id at execution.
+    
+    Returns:
+        Tuple of (safe_query, placeholder_count)
+    """
+    # Replace user_id placeholder with parameter
+    safe_query = sql_query.replace('{user_id}', '%s')
+    
+    # Single pass over the query: escape % characters inside string literals so they
+    # are not treated as placeholders, and count %s placeholders outside of them
+    placeholder_count = 0
+    
+    def rewrite_token(match):
+        nonlocal placeholder_count
+        token = match.group(0)
+        if token == '%s':
+            placeholder_count += 1
+        elif len(token) > 1 and token[-1] == "'":
+            return token.replace('%', '%%')
+        return token
+    
+    safe_query = _PARAM_TOKEN_RE.sub(rewrite_token, safe_query)
+    
+    return safe_query, placeholder_count
+
+def _orjson_default(value: Any) -> Any:
+    """Serialize MySQL column types orjson does not handle natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError
+
 class QueryExecutionAgent:
     """Specialized agent for executing SQL queries safely."""
     
+    # Seconds a database connection check result is reused (health endpoints poll often)
+    CONNECTION_CHECK_TTL = 5.0
+    
+    _CAPABILITIES = (
+        "Safe SQL query execution",
+        "Security validation",
+        "Query syntax testing",
+        "Result processing",
+        "Multi-query execution",
+        "Query statistics"
+    )
+    
     def __init__(self):
         """Initialize the query execution agent."""
-        self.db_manager = DatabaseManager()
-        self.query_guard = QuerySecurityGuard()
+        self.db_manager = get_db_manager()
+        self.query_guard = get_query_guard()
+        
+        # (checked_at, is_connected) from the last database connection check
+        self._connection_check: Optional[Tuple[float, bool]] = None
+        
+        # Static part of get_agent_info, built on first use
+        self._agent_info_cache: Optional[Dict[str, Any]] = None
         
         logger.info("QueryExecutionAgent initialized")
     
-    def execute_query(self, sql_query: str, user_id: int) -> Dict[str, Any]:
+    def execute_query(self, sql_query: str, user_id: int, process_results: bool = True) -> Dict[str, Any]:
         """Execute a SQL query safely with comprehensive validation.
         
         Args:
             sql_query: SQL query to execute
             user_id: User ID for security validation
+            process_results: Convert date/time values to ISO strings; when False,
+                "results" holds the raw rows (for callers serializing with orjson)
             
         Returns:
             Dictionary containing execution results and metadata
         """
+        now_iso = datetime.now().isoformat()
+        
         try:
-            logger.info(f"Executing query for user {user_id}: {sql_query}")
+            logger.info("Executing query for user %s: %s", user_id, sql_query)
             
             # Step 1: Security validation
             is_safe, reason = self.query_guard.validate_query(sql_query, user_id)
             if not is_safe:
-                logger.warning(f"Query blocked by security guard: {reason}")
+                logger.warning("Query blocked by security guard: %s", reason)
                 return {
                     "success": False,
                     "error": f"Query blocked for security: {reason}",
                     "query": sql_query,
                     "user_id": user_id,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso
                 }
             
             # Step 1.5: Check for modification requests (handle gracefully)
             if reason and reason.startswith("MODIFICATION_REQUEST:"):
                 modification_reason = reason.replace("MODIFICATION_REQUEST:", "")
-                logger.info(f"Modification request detected: {modification_reason}")
+                logger.info("Modification request detected: %s", modification_reason)
                 return {
                     "success": True,  # Return success but with modification flag
                     "is_modification_request": True,
                     "modification_reason": modification_reason,
                     "query": sql_query,
                     "user_id": user_id,
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": now_iso,
                     "results": [],  # No actual data results
                     "row_count": 0,
                     "columns": []
@@ -69,66 +164,98 @@ class QueryExecutionAgent:
             safe_query, params = self._prepare_query_parameters(sql_query, user_id)
             
             # Step 3: Execute query with validation
+            start_ns = time.monotonic_ns()
             execution_result = self.db_manager.execute_query_with_validation(safe_query, params)
+            execution_time_ms = (time.monotonic_ns() - start_ns) / 1e6
             
             # Step 4: Process results
             if execution_result["success"]:
-                processed_results = self._process_query_results(execution_result["results"])
-                
-                logger.info(f"Query executed successfully, returned {execution_result['row_count']} rows")
-                return {
+                logger.info("Query executed successfully, returned %s rows in %.1f ms", execution_result['row_count'], execution_time_ms)
+                result = {
                     "success": True,
-                    "results": processed_results,
-                    "raw_results": execution_result["results"],
+                    "results": execution_result["results"],
                     "row_count": execution_result["row_count"],
                     "columns": execution_result["columns"],
                     "query": sql_query,
                     "user_id": user_id,
-                    "timestamp": datetime.now().isoformat(),
-                    "execution_time": datetime.now().isoformat()
+                    "timestamp": now_iso,
+                    "execution_time_ms": execution_time_ms
                 }
+                if process_results:
+                    result["results"] = self._process_query_results(execution_result["results"])
+                    result["raw_results"] = execution_result["results"]
+                return result
             else:
-                logger.error(f"Query execution failed: {execution_result['error']}")
+                logger.error("Query execution failed: %s", execution_result['error'])
                 return {
                     "success": False,
                     "error": execution_result["error"],
                     "query": sql_query,
                     "user_id": user_id,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso
                 }
                 
         except Exception as e:
-            logger.error(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "query": sql_query,
                 "user_id": user_id,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso
             }
     
-    def execute_multiple_queries(self, queries: List[str], user_id: int) -> List[Dict[str, Any]]:
-        """Execute multiple queries safely.
+    def execute_query_json(self, sql_query: str, user_id: int) -> bytes:
+        """Execute a SQL query and return the result pre-serialized as JSON.
+        
+        Rows are serialized directly by orjson (dates and datetimes natively),
+        skipping the per-field conversion pass of _process_query_results, so
+        web endpoints can pass the bytes through without re-serializing.
+        
+        Args:
+            sql_query: SQL query to execute
+            user_id: User ID for security validation
+            
+        Returns:
+            UTF-8 encoded JSON of the execution result
+        """
+        result = self.execute_query(sql_query, user_id, process_results=False)
+        return orjson.dumps(result, default=_orjson_default)
+    
+    def execute_multiple_queries(self, queries: List[str], user_id: int, max_workers: int = 4) -> List[Dict[str, Any]]:
+        """Execute multiple queries safely and concurrently.
+        
+        Queries run in parallel (each on its own connection), but results are
+        returned in input order and stop at the first failed query, exactly as
+        with sequential execution.
         
         Args:
             queries: List of SQL queries to execute
             user_id: User ID for security validation
+            max_workers: Maximum number of queries executing at once
             
         Returns:
             List of execution results
         """
         results = []
+        if not queries:
+            return results
         
-        for i, query in enumerate(queries):
-            logger.info(f"Executing query {i+1}/{len(queries)} for user {user_id}")
-            result = self.execute_query(query, user_id)
-            result["query_index"] = i
-            results.append(result)
-            
-            # Stop execution if any query fails
-            if not result["success"]:
-                logger.warning(f"Stopping execution after query {i+1} failed")
-                break
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+            futures = [executor.submit(self.execute_query, query, user_id) for query in queries]
+            
+            for i, future in enumerate(futures):
+                logger.info("Collecting query %s/%s for user %s", i+1, len(queries), user_id)
+                result = future.result()
+                result["query_index"] = i
+                results.append(result)
+                
+                # Stop execution if any query fails
+                if not result["success"]:
+                    logger.warning("Stopping execution after query %s failed", i+1)
+                    for pending in futures[i + 1:]:
+                        pending.cancel()
+                    break
         
         return results
     
@@ -141,25 +268,12 @@ class QueryExecutionAgent:
         Returns:
             Dictionary containing syntax validation results
         """
+        now_iso = datetime.now().isoformat()
+        
         try:
-            # Basic syntax validation
-            sql_upper = sql_query.upper().strip()
-            
-            # Check for dangerous keywords
-            dangerous_keywords = ['DROP', 'DELETE', 'INSERT', 'UPDATE', 'ALTER', 'CREATE', 'TRUNCATE']
-            found_dangerous = [kw for kw in dangerous_keywords if kw in sql_upper]
-            
-            # Check for SELECT statement
-            has_select = sql_upper.startswith('SELECT')
-            
-            # Check for FROM clause
-            has_from = 'FROM' in sql_upper
-            
-            # Check for WHERE clause
-            has_where = 'WHERE' in sql_upper
-            
-            # Check for user_id filtering
-            has_user_id = 'USER_ID' in sql_upper
+            # Basic syntax validation: one case-insensitive scan collects every token of interest
+            has_select, has_from, has_where, has_user_id, dangerous = _scan_sql(sql_query)
+            found_dangerous = list(dangerous)
             
             syntax_valid = has_select and has_from and not found_dangerous
             
@@ -171,16 +285,16 @@ class QueryExecutionAgent:
                 "has_user_id": has_user_id,
                 "dangerous_keywords": found_dangerous,
                 "query": sql_query,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso
             }
             
         except Exception as e:
-            logger.error(f"Error testing query syntax: {e}")
+            logger.error("Error testing query syntax: %s", e)
             return {
                 "syntax_valid": False,
                 "error": str(e),
                 "query": sql_query,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso
             }
     
     def get_query_statistics(self, sql_query: str, user_id: int) -> Dict[str, Any]:
@@ -193,9 +307,11 @@ class QueryExecutionAgent:
         Returns:
             Dictionary containing query statistics
         """
+        now_iso = datetime.now().isoformat()
+        
         try:
-            # Execute query with LIMIT 0 to get metadata only
-            stats_query = f"SELECT COUNT(*) as total_rows FROM ({sql_query}) as subquery"
+            # Ask the query planner for its row estimate instead of materializing the result
+            stats_query = f"EXPLAIN {sql_query}"
             
             # Replace user_id placeholder
             safe_query, params = self._prepare_query_parameters(stats_query, user_id)
@@ -203,33 +319,60 @@ class QueryExecutionAgent:
             result = self.db_manager.execute_query_with_validation(safe_query, params)
             
             if result["success"]:
-                total_rows = result["results"][0]["total_rows"] if result["results"] else 0
+                total_rows = self._estimate_rows_from_plan(result["results"] or [])
                 
                 return {
                     "success": True,
                     "total_rows": total_rows,
-                    "estimated_size": self._estimate_result_size(total_rows, result["columns"]),
-                    "columns": result["columns"],
+                    "estimated": True,
+                    "estimated_size": self._estimate_result_size(total_rows, []),
                     "query": sql_query,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso
                 }
             else:
                 return {
                     "success": False,
                     "error": result["error"],
                     "query": sql_query,
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso
                 }
                 
         except Exception as e:
-            logger.error(f"Error getting query statistics: {e}")
+            logger.error("Error getting query statistics: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "query": sql_query,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now_iso
             }
     
+    def _estimate_rows_from_plan(self, plan: List[Dict[str, Any]]) -> int:
+        """Estimate the row count of a query from its MySQL EXPLAIN output.
+        
+        Tables joined within one SELECT (same id) multiply their estimates;
+        the SELECTs of a UNION add up. The planner estimates rows examined, so
+        aggregate queries report their input size rather than their output size.
+        
+        Args:
+            plan: Rows returned by EXPLAIN
+            
+        Returns:
+            Estimated number of rows
+        """
+        select_estimates = {}
+        
+        for step in plan:
+            rows = step.get("rows")
+            if rows is None:  # e.g. UNION RESULT steps
+                continue
+            
+            filtered = step.get("filtered")
+            estimate = float(rows) * (float(filtered) if filtered is not None else 100.0) / 100.0
+            select_id = step.get("id")
+            select_estimates[select_id] = select_estimates.get(select_id, 1.0) * estimate
+        
+        return int(round(sum(select_estimates.values())))
+    
     def _prepare_query_parameters(self, sql_query: str, user_id: int) -> Tuple[str, Tuple]:
         """Prepare query parameters for safe execution.
         
@@ -240,27 +383,7 @@ class QueryExecutionAgent:
         Returns:
             Tuple of (safe_query, params)
         """
-        # Replace user_id placeholder with parameter
-        safe_query = sql_query.replace('{user_id}', '%s')
-        
-        # Escape % characters in string literals to prevent them from being treated as placeholders
-        import re
-        # Find string literals (content between single quotes) and escape % characters
-        def escape_string_literal(match):
-            content = match.group(1)
-            escaped_content = content.replace('%', '%%')
-            return f"'{escaped_content}'"
-        
-        safe_query = re.sub(r"'([^']*)'", escape_string_literal, safe_query)
-        
-        # Count only %s placeholders that are not inside string literals
-        # Split by single quotes and count %s in odd-indexed parts (outside strings)
-        parts = safe_query.split("'")
-        placeholder_count = 0
-        
-        for i, part in enumerate(parts):
-            if i % 2 == 0:  # Even indices are outside string literals
-                placeholder_count += part.count('%s')
+        safe_query, placeholder_count = _compile_query_template(sql_query)
         
         # Create parameters tuple with the right number of parameters
         params = (user_id,) * placeholder_count
@@ -305,7 +428,7 @@ class QueryExecutionAgent:
             return None
             
         except Exception as e:
-            logger.error(f"Error checking for data modification: {e}")
+            logger.error("Error checking for data modification: %s", e)
             return f"Data modification check error: {str(e)}"
     
     def _process_query_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -320,20 +443,30 @@ class QueryExecutionAgent:
         if not results:
             return []
         
+        # Database result columns are homogeneous, so detect the date/time columns once
+        # from the first non-NULL value of each column instead of type-checking every value
+        temporal_columns = []
+        for key in results[0]:
+            for row in results:
+                value = row.get(key)
+                if value is not None:
+                    if hasattr(value, 'isoformat'):
+                        temporal_columns.append(key)
+                    break
+        
+        if not temporal_columns:
+            return [dict(row) for row in results]
+        
         processed_results = []
         
         for row in results:
-            processed_row = {}
+            processed_row = dict(row)
             
-            for key, value in row.items():
-                # Convert datetime objects to strings
-                if isinstance(value, datetime):
+            # Convert datetime/date/time objects to strings
+            for key in temporal_columns:
+                value = processed_row.get(key)
+                if value is not None:
                     processed_row[key] = value.isoformat()
-                # Convert other non-serializable objects
-                elif hasattr(value, 'isoformat'):
-                    processed_row[key] = value.isoformat()
-                else:
-                    processed_row[key] = value
             
             processed_results.append(processed_row)
         
@@ -360,30 +493,37 @@ class QueryExecutionAgent:
         else:
             return "Very large dataset"
     
-    def validate_database_connection(self) -> bool:
+    def validate_database_connection(self, force_refresh: bool = False) -> bool:
         """Validate database connection.
         
+        The result is cached for CONNECTION_CHECK_TTL seconds.
+        
+        Args:
+            force_refresh: Probe the database even if a cached result is available
+            
         Returns:
             True if connection is valid, False otherwise
         """
+        cached = self._connection_check
+        now = time.monotonic()
+        if not force_refresh and cached and now - cached[0] < self.CONNECTION_CHECK_TTL:
+            return cached[1]
+        
         try:
-            return self.db_manager.test_connection()
+            is_connected = self.db_manager.test_connection()
         except Exception as e:
-            logger.error(f"Database connection validation failed: {e}")
-            return False
+            logger.error("Database connection validation failed: %s", e)
+            is_connected = False
+        
+        self._connection_check = (now, is_connected)
+        return is_connected
     
     def get_agent_info(self) -> Dict[str, Any]:
         """Get information about the query execution agent."""
-        return {
-            "agent_type": "Query Execution Agent",
-            "capabilities": [
-                "Safe SQL query execution",
-                "Security validation",
-                "Query syntax testing",
-                "Result processing",
-                "Multi-query execution",
-                "Query statistics"
-            ],
-            "database_connected": self.validate_database_connection(),
-            "status": "active"
-        }
+        if self._agent_info_cache is None:
+            self._agent_info_cache = {
+                "agent_type": "Query Execution Agent",
+                "capabilities": self._CAPABILITIES,
+                "status": "active"
+            }
+        return self._agent_info_cache | {"database_connected": self.validate_database_connection()}
@@ -5,7 +5,7 @@ Specialized agent for converting query results into natural language responses.
 
 import json
 import logging
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Callable
 from datetime import datetime
 
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -62,13 +62,16 @@ class ResponseFormattingAgent:
             raise
     
     @traceable(name="response_formatting", project_name="web-activity-agent-system")
-    def format_response(self, question: str, query_results: Dict[str, Any], sql_query: str = None) -> Dict[str, Any]:
+    def format_response(self, question: str, query_results: Dict[str, Any], sql_query: str = None,
+                        on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """Format query results into a structured JSON response.
         
         Args:
             question: Original user question
             query_results: Query execution results
             sql_query: SQL query that was executed (optional)
+            on_token: Callback receiving raw response chunks as they stream in (optional).
+                Chunks are not yet sanitized; the returned response is the sanitized final text.
             
         Returns:
             Dictionary containing response and results or None if failed
@@ -88,11 +91,10 @@ class ResponseFormattingAgent:
             
             # Generate formatted response using Gemini
             try:
-                response = self.model.invoke(prompt_text)
+                response_text = self._generate_response_text(prompt_text, on_token)
                 
                 # Parse Gemini text response
                 try:
-                    response_text = response.content.strip()
                     logger.info(f"Raw Gemini response: {response_text[:200]}...")
                     
                     # Extract structured response from text
@@ -146,6 +148,26 @@ class ResponseFormattingAgent:
                 "metadata": {}
             }
     
+    def _generate_response_text(self, prompt_text: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Generate response text, streaming chunks to on_token when provided.
+        
+        Args:
+            prompt_text: Rendered response formatting prompt
+            on_token: Callback receiving each response chunk (optional)
+            
+        Returns:
+            Complete response text
+        """
+        if not on_token:
+            return self.model.invoke(prompt_text).content.strip()
+        
+        chunks = []
+        for chunk in self.model.stream(prompt_text):
+            chunks.append(chunk.content)
+            on_token(chunk.content)
+        
+        return "".join(chunks).strip()
+    
     def format_error_response(self, question: str, error_message: str, error_type: str = "general") -> str:
         """Format error responses in a user-friendly way.
         
@@ -4,22 +4,48 @@ Provides comprehensive database schema information to other agents.
 """
 
 import logging
-from typing import Dict, Any, Optional, List
-from backend.database.db_manager import DatabaseManager
+import re
+from typing import Dict, Any, Optional, List, Callable, Collection, FrozenSet
+from backend.database.db_manager import get_db_manager
 
 logger = logging.getLogger(__name__)
 
+# Alphanumeric words (identifiers split on underscores)
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
 class SchemaAwarenessAgent:
     """Agent responsible for providing database schema information."""
     
     def __init__(self):
         """Initialize the schema awareness agent."""
-        self.db_manager = DatabaseManager()
+        self.db_manager = get_db_manager()
         self._schema_cache = {}
         self._cache_timestamp = None
+        self._schema_version = 0
+        self._schema_change_listeners: List[Callable[[], None]] = []
         
         logger.info("SchemaAwarenessAgent initialized")
     
+    def add_schema_change_listener(self, callback: Callable[[], None]):
+        """Register a callback invoked when a refresh detects a changed schema.
+        
+        Args:
+            callback: Function called with no arguments on schema change
+        """
+        self._schema_change_listeners.append(callback)
+    
+    def schema_version(self) -> int:
+        """Get a counter that increases each time a refresh detects a schema change."""
+        return self._schema_version
+    
+    def _notify_schema_change(self):
+        """Notify registered listeners that the database schema changed."""
+        for callback in self._schema_change_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Schema change listener failed: {e}")
+    
     def get_database_schema(self, force_refresh: bool = False) -> Dict[str, Any]:
         """Get complete database schema information.
         
@@ -37,12 +63,23 @@ class SchemaAwarenessAgent:
             
             logger.info("Fetching fresh database schema")
             schema_info = self.db_manager.get_database_schema()
+            if not schema_info:
+                # A failed fetch returns {}; keep the last known schema and retry next time
+                logger.warning("Schema fetch returned no tables; keeping the cached schema")
+                return self._schema_cache
+            schema_changed = bool(self._schema_cache) and schema_info != self._schema_cache
             
             # Cache the schema
             self._schema_cache = schema_info
             self._cache_timestamp = self._get_current_timestamp()
             
             logger.info(f"Schema fetched successfully: {len(schema_info)} tables")
+            
+            if schema_changed:
+                logger.info("Database schema changed since last fetch")
+                self._schema_version += 1
+                self._notify_schema_change()
+            
             return schema_info
             
         except Exception as e:
@@ -130,9 +167,13 @@ class SchemaAwarenessAgent:
             logger.error(f"Error getting query examples: {e}")
             return []
     
-    def format_schema_for_llm(self) -> str:
+    def format_schema_for_llm(self, relevant_tables: Optional[Collection[str]] = None) -> str:
         """Format database schema in a way that's useful for LLM consumption.
         
+        Args:
+            relevant_tables: Tables to describe in full; the others are reduced to
+                one-line stubs (all tables in full if None)
+        
         Returns:
             Formatted string describing the database schema
         """
@@ -144,24 +185,11 @@ class SchemaAwarenessAgent:
             schema_text = "DATABASE SCHEMA:\n\n"
             
             for table_name, table_info in schema.items():
-                schema_text += f"Table: {table_name}\n"
-                
-                if table_info.get('comment'):
-                    schema_text += f"Description: {table_info['comment']}\n"
-                
-                schema_text += "Columns:\n"
-                
-                if table_info.get('columns'):
-                    for column in table_info['columns']:
-                        col_name = column['COLUMN_NAME']
-                        col_type = column['DATA_TYPE']
-                        nullable = "NULL" if column['IS_NULLABLE'] == 'YES' else "NOT NULL"
-                        default = f" DEFAULT {column['COLUMN_DEFAULT']}" if column['COLUMN_DEFAULT'] else ""
-                        comment = f" -- {column['COLUMN_COMMENT']}" if column['COLUMN_COMMENT'] else ""
-                        
-                        schema_text += f"  - {col_name}: {col_type} {nullable}{default}{comment}\n"
-                
-                schema_text += "\n"
+                if relevant_tables is None or table_name in relevant_tables:
+                    schema_text += self._format_table_for_llm(table_name, table_info)
+                else:
+                    column_count = len(table_info.get('columns') or [])
+                    schema_text += f"Table: {table_name} (stub: {column_count} columns, not relevant to this question)\n\n"
             
             # Add example queries
             examples = self.get_query_examples()
@@ -177,6 +205,43 @@ class SchemaAwarenessAgent:
             logger.error(f"Error formatting schema for LLM: {e}")
             return "Error retrieving database schema information."
     
+    def _format_table_for_llm(self, table_name: str, table_info: Dict[str, Any]) -> str:
+        """Format the full description of one table."""
+        table_text = f"Table: {table_name}\n"
+        
+        if table_info.get('comment'):
+            table_text += f"Description: {table_info['comment']}\n"
+        
+        table_text += "Columns:\n"
+        
+        if table_info.get('columns'):
+            for column in table_info['columns']:
+                col_name = column['COLUMN_NAME']
+                col_type = column['DATA_TYPE']
+                nullable = "NULL" if column['IS_NULLABLE'] == 'YES' else "NOT NULL"
+                default = f" DEFAULT {column['COLUMN_DEFAULT']}" if column['COLUMN_DEFAULT'] else ""
+                comment = f" -- {column['COLUMN_COMMENT']}" if column['COLUMN_COMMENT'] else ""
+                
+                table_text += f"  - {col_name}: {col_type} {nullable}{default}{comment}\n"
+        
+        return table_text + "\n"
+    
+    def get_table_keywords(self) -> Dict[str, FrozenSet[str]]:
+        """Get the words naming or describing each table and its columns.
+        
+        Returns:
+            Dictionary mapping table name to its lowercase keywords, in schema order
+        """
+        keywords = {}
+        for table_name, table_info in self.get_database_schema().items():
+            words = set(_WORD_RE.findall(table_name.lower()))
+            words.update(_WORD_RE.findall((table_info.get('comment') or '').lower()))
+            for column in table_info.get('columns') or []:
+                words.update(_WORD_RE.findall(column['COLUMN_NAME'].lower()))
+                words.update(_WORD_RE.findall((column.get('COLUMN_COMMENT') or '').lower()))
+            keywords[table_name] = frozenset(words)
+        return keywords
+    
     def validate_table_exists(self, table_name: str) -> bool:
         """Check if a table exists in the database.
         
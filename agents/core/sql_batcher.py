@@ -0,0 +1,122 @@
+"""
+SQL Generation Batcher.
+Micro-batches concurrent SQL generation requests so questions arriving within a
+short window share a single LLM call (and its instructions and schema tokens).
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from agents.core.sql_agent import SQLGenerationAgent
+
+logger = logging.getLogger(__name__)
+
+class SQLGenerationBatcher:
+    """Collects concurrent SQL generation requests and sends them as batches."""
+
+    def __init__(self, sql_agent: SQLGenerationAgent, max_batch_size: int = 8, max_wait_ms: float = 50.0):
+        """Initialize the batcher.
+
+        Args:
+            sql_agent: SQL generation agent used for batch and single generation
+            max_batch_size: Flush a batch once it holds this many questions
+            max_wait_ms: Flush a batch at the latest this long after its first question
+        """
+        self.sql_agent = sql_agent
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        # Created lazily on the event loop that submits the first request
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+        logger.info(f"SQLGenerationBatcher initialized (max_batch_size={max_batch_size}, max_wait={max_wait_ms}ms)")
+
+    async def submit(self, question: str, user_id: int, current_date: str = None) -> Optional[str]:
+        """Queue a question for batched SQL generation and wait for its query.
+
+        Args:
+            question: User's natural language question
+            user_id: User ID for database filtering
+            current_date: Current date (optional)
+
+        Returns:
+            Generated SQL query or None if failed
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((question, user_id, current_date, future))
+        return await future
+
+    def _ensure_worker(self):
+        """Start the collecting task on the running event loop if needed."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._collect_batches())
+
+    async def _collect_batches(self):
+        """Group queued requests into batches by size or wait time."""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Flush in the background so the next batch is collected meanwhile
+            task = self._loop.create_task(self._flush(batch))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[str, int, Optional[str], asyncio.Future]]):
+        """Generate SQL for a batch and resolve each request's future."""
+        # Requests cancelled while queued (e.g. served from cache) are dropped
+        groups: Dict[Optional[str], list] = {}
+        for item in batch:
+            if not item[3].done():
+                groups.setdefault(item[2], []).append(item)
+
+        for current_date, items in groups.items():
+            try:
+                if len(items) == 1:
+                    question, user_id, _, _ = items[0]
+                    results = [await self.sql_agent.agenerate_sql_query(question, user_id, current_date)]
+                else:
+                    results = await self.sql_agent.agenerate_sql_queries_batch(
+                        [(question, user_id) for question, user_id, _, _ in items], current_date
+                    )
+
+                    # Retry questions the batch response did not cover individually
+                    retry = [index for index, result in enumerate(results) if result is None]
+                    if retry:
+                        logger.info(f"Retrying {len(retry)} of {len(items)} batched questions individually")
+                        retried = await asyncio.gather(*(
+                            self.sql_agent.agenerate_sql_query(items[index][0], items[index][1], current_date)
+                            for index in retry
+                        ))
+                        for index, result in zip(retry, retried):
+                            results[index] = result
+
+                for (_, _, _, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+
+            except Exception as e:
+                logger.error(f"Error flushing SQL generation batch: {e}")
+                for _, _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
@@ -5,6 +5,7 @@ Provides multiple layers of security for SQL query validation and execution.
 
 import re
 import logging
+import threading
 from typing import List, Tuple, Dict, Any, Optional
 from enum import Enum
 
@@ -59,6 +60,18 @@ class QuerySecurityGuard:
             'UNION', 'UNION ALL'  # Allow UNION operations for multi-table queries
         ]
         
+        # Compiled single-pass scanner for fast validation (see scan_query)
+        self._forbidden_re = re.compile(
+            r'\b(?:' + '|'.join(self.dangerous_keywords) + r')\b'  # Dangerous keywords
+            r'|;\s*\S'                                              # Statement after a semicolon
+            r'|--|/\*|#'                                            # Comment sequences
+            r'|\bxp_\w*'                                            # Extended stored procedures
+            r'|\b(?:MYSQL|PERFORMANCE_SCHEMA|SYS)\s*\.',             # System schema access
+            re.IGNORECASE
+        )
+        self._select_re = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+        self._user_id_filter_re = re.compile(r'\bWHERE\b.*\bUSER_ID\s*=\s*%s', re.IGNORECASE | re.DOTALL)
+        
         logger.info(f"QuerySecurityGuard initialized with {security_level.value} security level")
     
     def validate_query(self, sql_query: str, user_id: int) -> Tuple[bool, str]:
@@ -119,6 +132,25 @@ class QuerySecurityGuard:
             logger.error(f"Error during query validation: {e}")
             return False, f"Validation error: {str(e)}"
     
+    def scan_query(self, sql_query: str) -> bool:
+        """Fast safety scan using precompiled patterns.
+        
+        Args:
+            sql_query: SQL query to scan
+            
+        Returns:
+            True if the query is a SELECT with user_id filtering and no forbidden pattern
+        """
+        if not sql_query or not self._select_re.match(sql_query):
+            return False
+        
+        forbidden = self._forbidden_re.search(sql_query)
+        if forbidden:
+            logger.warning(f"Query scan found forbidden pattern: {forbidden.group(0)}")
+            return False
+        
+        return bool(self._user_id_filter_re.search(sql_query))
+    
     def _check_dangerous_keywords(self, sql_upper: str) -> str:
         """Check for dangerous SQL keywords."""
         for keyword in self.dangerous_keywords:
@@ -316,6 +348,20 @@ class QuerySecurityGuard:
         
         return sql_query.strip()
 
+# Shared query guard instances, one per security level
+_QUERY_GUARDS: Dict[SecurityLevel, QuerySecurityGuard] = {}
+_QUERY_GUARDS_LOCK = threading.Lock()
+
+def get_query_guard(security_level: SecurityLevel = SecurityLevel.MEDIUM) -> QuerySecurityGuard:
+    """Get the shared query security guard for a security level, creating it on first use."""
+    guard = _QUERY_GUARDS.get(security_level)
+    if guard is None:
+        with _QUERY_GUARDS_LOCK:
+            guard = _QUERY_GUARDS.get(security_level)
+            if guard is None:
+                guard = _QUERY_GUARDS[security_level] = QuerySecurityGuard(security_level)
+    return guard
+
 class ResponseSecurityGuard:
     """Security guard for LLM response validation."""
     
@@ -16,6 +16,17 @@ class SQLQueryResponse(BaseModel):
     reasoning: str = Field(description="Brief explanation of the query logic")
     confidence: float = Field(description="Confidence score between 0 and 1", ge=0, le=1)
 
+class BatchSQLQueryItem(BaseModel):
+    """Generated SQL query for one question of a batch."""
+    id: int = Field(description="Index of the question in the batch")
+    sql_query: str = Field(description="The generated SQL query")
+    reasoning: Optional[str] = Field(description="Brief explanation of the query logic", default=None)
+    confidence: Optional[float] = Field(description="Confidence score between 0 and 1", default=None)
+
+class BatchSQLQueryResponse(BaseModel):
+    """Structured response for batched SQL query generation."""
+    results: List[BatchSQLQueryItem] = Field(description="One generated query per question")
+
 class DataAnalysisResponse(BaseModel):
     """Structured response for data analysis and formatting."""
     response: str = Field(description="Natural language response to the user's question")
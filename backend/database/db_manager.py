@@ -5,6 +5,7 @@ Handles safe database connections and query execution.
 
 import pymysql
 import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from contextlib import contextmanager
 
@@ -13,17 +14,28 @@ from config import DATABASE_CONFIG
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
-    """Manages database connections and query execution."""
+    """Manages database connections and query execution.
+    
+    Connections are scoped to a single operation: every method acquires a
+    connection, uses it and closes it before returning, so no connection is
+    held while callers wait on slow work such as LLM calls.
+    """
     
     def __init__(self):
         """Initialize database manager."""
         self.config = DATABASE_CONFIG
+        self._local = threading.local()
         logger.info("DatabaseManager initialized")
     
+    def has_open_connection(self) -> bool:
+        """Check whether the current thread holds an open database connection."""
+        return getattr(self._local, 'open_connections', 0) > 0
+    
     @contextmanager
     def get_connection(self):
         """Get database connection with context manager."""
         conn = None
+        self._local.open_connections = getattr(self._local, 'open_connections', 0) + 1
         try:
             conn = pymysql.connect(
                 host=self.config['host'],
@@ -38,6 +50,7 @@ class DatabaseManager:
             logger.error(f"Database connection error: {e}")
             raise
         finally:
+            self._local.open_connections -= 1
             if conn:
                 conn.close()
     
@@ -84,6 +97,10 @@ class DatabaseManager:
             with self.get_connection() as conn:
                 cursor = conn.cursor(pymysql.cursors.DictCursor)
                 
+                # PyMySQL interpolates parameters client-side and has no server-side
+                # prepared statements, and connections live for a single call, so a
+                # statement handle cache would never hit; the query template
+                # preparation is memoized by the caller instead
                 if params:
                     cursor.execute(sql_query, params)
                 else:
@@ -231,3 +248,16 @@ class DatabaseManager:
                 "sql": "SELECT DISTINCT repository_name as name, 'repository' as type FROM github_activity WHERE user_id = %s AND repository_name IS NOT NULL UNION ALL SELECT DISTINCT website_name as name, 'website' as type FROM web_activity WHERE user_id = %s AND website_name IS NOT NULL ORDER BY name"
             }
         ]
+
+# Shared database manager instance (one per process)
+_DB_MANAGER: Optional[DatabaseManager] = None
+_DB_MANAGER_LOCK = threading.Lock()
+
+def get_db_manager() -> DatabaseManager:
+    """Get the shared database manager instance, creating it on first use."""
+    global _DB_MANAGER
+    if _DB_MANAGER is None:
+        with _DB_MANAGER_LOCK:
+            if _DB_MANAGER is None:
+                _DB_MANAGER = DatabaseManager()
+    return _DB_MANAGER
@@ -28,6 +28,34 @@ class Config:
     API_HOST = '127.0.0.1'
     API_PORT = 5001
     
+    # Semantic response cache configuration
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+    SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+    EMBEDDING_MODEL = os.getenv('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004')
+    
+    # Semantic SQL cache configuration (paraphrased questions reuse generated SQL)
+    SEMANTIC_SQL_CACHE_ENABLED = os.getenv('SEMANTIC_SQL_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_SQL_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_SQL_CACHE_THRESHOLD', '0.93'))
+    SEMANTIC_SQL_CACHE_PATH = os.getenv('SEMANTIC_SQL_CACHE_PATH')
+    
+    # Redis-backed SQL cache shared across workers (disabled when REDIS_URL is unset)
+    REDIS_URL = os.getenv('REDIS_URL')
+    SHARED_SQL_CACHE_TTL = int(os.getenv('SHARED_SQL_CACHE_TTL', '86400'))
+    
+    # Micro-batching of concurrent SQL generation requests (async API only)
+    SQL_BATCHING_ENABLED = os.getenv('SQL_BATCHING_ENABLED', 'false').lower() == 'true'
+    SQL_BATCH_MAX_SIZE = int(os.getenv('SQL_BATCH_MAX_SIZE', '8'))
+    SQL_BATCH_MAX_WAIT_MS = float(os.getenv('SQL_BATCH_MAX_WAIT_MS', '50'))
+    
+    # Complexity-based routing of SQL generation (templates, fast model, configured model)
+    SQL_ROUTING_ENABLED = os.getenv('SQL_ROUTING_ENABLED', 'false').lower() == 'true'
+    SQL_FAST_MODEL = os.getenv('SQL_FAST_MODEL', 'models/gemini-2.5-flash')
+    SQL_ROUTER_FAST_THRESHOLD = int(os.getenv('SQL_ROUTER_FAST_THRESHOLD', '3'))
+    
+    # Share of queries additionally audited by the LLM after the pattern scan (0.0 - 1.0)
+    LLM_DEEP_AUDIT_RATE = float(os.getenv('LLM_DEEP_AUDIT_RATE', '0.0'))
+    
     @classmethod
     def get_database_config(cls) -> Dict[str, Any]:
         """Get database configuration as a dictionary."""
@@ -86,8 +86,8 @@ def create_app():
         """Get overall system status."""
         try:
             # Test database connection
-            from backend.database.db_manager import DatabaseManager
-            db_manager = DatabaseManager()
+            from backend.database.db_manager import get_db_manager
+            db_manager = get_db_manager()
             db_healthy = db_manager.test_connection()
             
             # Check agent status
@@ -153,8 +153,8 @@ async def startup_event():
             logger.error("GEMINI_API_KEY not found in environment variables")
             return
         
-    # Get model name
-    model_name = os.getenv("GEMINI_MODEL", "models/gemini-2.5-pro")
+        # Get model name
+        model_name = os.getenv("GEMINI_MODEL", "models/gemini-2.5-pro")
         
         # Initialize LangSmith tracing
         langsmith_client = setup_langsmith_tracing()
@@ -197,8 +197,8 @@ async def ask_question(
     try:
         logger.info(f"Processing question for user {request.user_id}: {request.question}")
         
-        # Process question with agent
-        result = agent.process_question(request.question, request.user_id)
+        # Process question with agent without blocking the event loop
+        result = await agent.aprocess_question(request.question, request.user_id)
         
         # Return appropriate status code based on success
         if not result.get('success', False):
@@ -280,6 +280,32 @@ async def get_agent_info(agent: LLMDatabaseAgent = Depends(get_agent)):
             }
         )
 
+@app.post("/api/agent/schema/refresh", response_model=Dict[str, Any])
+async def refresh_schema(agent: LLMDatabaseAgent = Depends(get_agent)):
+    """
+    Refresh the database schema used for SQL generation.
+    
+    Call after schema migrations so new tables and columns are picked up
+    before the schema cache expires.
+    """
+    try:
+        result = agent.refresh_schema()
+        return {
+            "success": True,
+            **result,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"Error in refresh_schema endpoint: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "error": "Internal server error"
+            }
+        )
+
 @app.get("/api/agent/examples", response_model=QueryExamplesResponse)
 async def get_query_examples(agent: LLMDatabaseAgent = Depends(get_agent)):
     """
@@ -5,12 +5,19 @@ Interactive chatbot interface for natural language database queries.
 """
 
 import streamlit as st
-import requests
+import httpx
 import json
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from datetime import datetime, timedelta
 import time
 import os
+import tempfile
+import uuid
 from typing import Dict, Any, List
 
 # Page configuration
@@ -397,24 +404,34 @@ st.markdown(get_css(dark_mode), unsafe_allow_html=True)
 API_BASE_URL = "http://127.0.0.1:5001"  # Updated to port 5001
 USER_ID = 1  # Default user ID
 
+# Results of answers older than this many turns and larger than this many bytes
+# are written to Parquet files and only reloaded when shown again
+PAGE_OUT_AFTER_TURNS = 4
+PAGE_OUT_MIN_BYTES = 500
+
 class AgentClient:
     """Client for interacting with the Flask backend."""
     
     def __init__(self, base_url: str):
         self.base_url = base_url
-        self.session = requests.Session()
+        # Persistent HTTP/2 keep-alive connection pool reused across requests
+        self.client = httpx.Client(
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=10)
+        )
     
     def ask_question(self, question: str, user_id: int = USER_ID) -> Dict[str, Any]:
         """Ask a question to the agent system."""
         try:
-            response = self.session.post(
+            response = self.client.post(
                 f"{self.base_url}/api/agent/ask",
                 json={"question": question, "user_id": user_id},
                 timeout=30
             )
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return orjson.loads(response.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
             return {
                 "success": False,
                 "error": f"API Error: {str(e)}",
@@ -424,22 +441,37 @@ class AgentClient:
     def get_health_status(self) -> Dict[str, Any]:
         """Get system health status."""
         try:
-            response = self.session.get(f"{self.base_url}/api/agent/health", timeout=5)
+            response = self.client.get(f"{self.base_url}/api/agent/health", timeout=5)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException:
+            return orjson.loads(response.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError):
             return {"status": "unhealthy", "error": "Cannot connect to API"}
     
     def get_examples(self) -> List[Dict[str, str]]:
         """Get example queries."""
         try:
-            response = self.session.get(f"{self.base_url}/api/agent/examples", timeout=5)
+            response = self.client.get(f"{self.base_url}/api/agent/examples", timeout=5)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             return data.get("examples", [])
-        except requests.exceptions.RequestException:
+        except (httpx.HTTPError, orjson.JSONDecodeError):
             return []
 
+@st.cache_resource
+def get_agent_client(base_url: str) -> AgentClient:
+    """Get the agent client shared across reruns and sessions."""
+    return AgentClient(base_url)
+
+@st.cache_data(ttl=30)
+def _cached_health(base_url: str) -> Dict[str, Any]:
+    """Get system health status, reused across reruns for 30 seconds."""
+    return get_agent_client(base_url).get_health_status()
+
+@st.cache_data(ttl=300)
+def _cached_examples(base_url: str) -> List[Dict[str, str]]:
+    """Get example queries, reused across reruns for 5 minutes."""
+    return get_agent_client(base_url).get_examples()
+
 def display_chat_message(message: str, is_user: bool = False, timestamp: datetime = None):
     """Display a chat message with modern styling."""
     message_class = "user-message" if is_user else "bot-message"
@@ -457,6 +489,82 @@ def display_sql_query(sql_query: str):
     st.markdown("**🔍 Generated SQL Query:**")
     st.markdown(f'<div class="sql-container">{sql_query}</div>', unsafe_allow_html=True)
 
+def _top_value_counts(series: pd.Series, limit: int = 10):
+    """Count values with NumPy and keep the most frequent ones.
+    
+    Returns:
+        Tuple of (top value counts as a Series, number of distinct values)
+    """
+    values = series.dropna().to_numpy()
+    try:
+        uniques, counts = np.unique(values, return_counts=True)
+    except TypeError:
+        # Mixed, unorderable object values: fall back to hashing in pandas
+        value_counts = series.value_counts()
+        return value_counts.head(limit), len(value_counts)
+    
+    if len(uniques) > limit:
+        top = np.argpartition(-counts, limit - 1)[:limit]
+    else:
+        top = np.arange(len(uniques))
+    top = top[np.argsort(-counts[top], kind='stable')]
+    
+    return pd.Series(counts[top], index=uniques[top], name='count'), len(uniques)
+
+_SUMMARY_INDEX = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+def _numeric_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Compute describe()-style statistics with Arrow compute kernels.
+    
+    Each column is converted to Arrow once and reduced in C instead of going
+    through pandas' per-statistic dispatch.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    summary = {}
+    for name, column in zip(table.column_names, table.columns):
+        column = column.cast(pa.float64())
+        min_max = pc.min_max(column)
+        quartiles = pc.quantile(column, q=[0.25, 0.5, 0.75]).to_pylist()
+        summary[name] = [
+            pc.count(column).as_py(),
+            pc.mean(column).as_py(),
+            pc.stddev(column, ddof=1).as_py(),
+            min_max['min'].as_py(),
+            *quartiles,
+            min_max['max'].as_py(),
+        ]
+    
+    return pd.DataFrame(summary, index=_SUMMARY_INDEX, dtype='float64')
+
+@st.cache_data(ttl=600, max_entries=128)
+def _prep_df(results_json: bytes):
+    """Build the DataFrame and derived statistics for a result set.
+    
+    Cached by the serialized results so past answers in the chat history are
+    not recomputed on every rerun. The bytes keep the original key order, so
+    columns are shown in SELECT order.
+    
+    Returns:
+        Tuple of (df, numeric summary or None, list of (chart slot, title, value counts))
+    """
+    df = pd.DataFrame(orjson.loads(results_json))
+    
+    # Basic statistics for numeric data
+    numeric_cols = df.select_dtypes(include=['number']).columns
+    numeric_summary = _numeric_summary(df[numeric_cols]) if len(numeric_cols) > 0 else None
+    
+    # Charts for categorical data
+    charts = []
+    categorical_cols = df.select_dtypes(include=['object']).columns
+    for i, col in enumerate(categorical_cols[:2]):  # Show first 2 categorical columns
+        value_counts, unique_count = _top_value_counts(df[col])
+        if unique_count <= 15:  # Only show if not too many unique values
+            charts.append((i % 2, f"{col.replace('_', ' ').title()} Distribution:", value_counts))
+        elif i == 0:  # Show first column even if many values
+            charts.append((0, f"{col.replace('_', ' ').title()} (Top 10):", value_counts))
+    
+    return df, numeric_summary, charts
+
 def display_results(results: List[Dict[str, Any]], question: str):
     """Display query results with modern styling."""
     if not results:
@@ -465,50 +573,81 @@ def display_results(results: List[Dict[str, Any]], question: str):
     
     st.markdown(f'<div class="results-container">', unsafe_allow_html=True)
     
-    # Convert to DataFrame for better display
-    df = pd.DataFrame(results)
+    # Convert to DataFrame for better display (cached per result set)
+    df, numeric_summary, charts = _prep_df(orjson.dumps(results, default=str))
     
     # Display basic info
     st.markdown(f"**📊 Found {len(results)} results**")
     
     # Display as table
-    st.dataframe(df, width='stretch')
+    st.dataframe(df, width='stretch', hide_index=True)
     
     # Create visualizations based on data
     if len(df) > 1:
-        create_visualizations(df, question)
+        create_visualizations(numeric_summary, charts, question)
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-def create_visualizations(df: pd.DataFrame, question: str):
-    """Create visualizations based on the data."""
+def _page_out_history(chat_history: List[Dict[str, Any]]):
+    """Move the results of old answers out of session memory into Parquet files.
+    
+    Each paged-out message keeps a stub with the row count and file path in
+    place of its results.
+    """
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    
+    answer_turns = [i for i, message in enumerate(chat_history) if not message['is_user']]
+    for turn in answer_turns[:-PAGE_OUT_AFTER_TURNS]:
+        message = chat_history[turn]
+        results = message.get('results')
+        if not isinstance(results, list) or len(orjson.dumps(results, default=str)) < PAGE_OUT_MIN_BYTES:
+            continue
+        
+        path = os.path.join(tempfile.gettempdir(), f"sess_{st.session_state.session_id}_turn_{turn}.parquet")
+        try:
+            pq.write_table(pa.Table.from_pylist(results), path, compression='zstd')
+        except (pa.ArrowException, OSError):
+            continue  # Keep results that Arrow cannot represent in memory
+        
+        message['results'] = {"_paged": True, "rows": len(results), "path": path}
+
+@st.cache_data(max_entries=8)
+def _load_paged_results(path: str) -> List[Dict[str, Any]]:
+    """Read results previously paged out to a Parquet file."""
+    return pq.read_table(path).to_pylist()
+
+def _clear_paged_results(chat_history: List[Dict[str, Any]]):
+    """Delete the Parquet files of paged-out results."""
+    for message in chat_history:
+        results = message.get('results')
+        if isinstance(results, dict) and results.get('_paged'):
+            try:
+                os.remove(results['path'])
+            except OSError:
+                pass
+    _load_paged_results.clear()
+
+def create_visualizations(numeric_summary: pd.DataFrame, charts: list, question: str):
+    """Create visualizations from precomputed statistics."""
     st.markdown("**📈 Data Analysis:**")
     
     # Display basic statistics for numeric data
-    numeric_cols = df.select_dtypes(include=['number']).columns
-    if len(numeric_cols) > 0:
+    if numeric_summary is not None:
         st.markdown("**📊 Numeric Data Summary:**")
-        st.dataframe(df[numeric_cols].describe(), width='stretch')
+        st.dataframe(numeric_summary, width='stretch')
     
     # Display charts for categorical data
-    categorical_cols = df.select_dtypes(include=['object']).columns
-    if len(categorical_cols) > 0:
+    if charts:
         st.markdown("**📋 Categorical Data Charts:**")
         
         # Create columns for charts
-        chart_cols = st.columns(min(len(categorical_cols), 2))
+        chart_cols = st.columns(min(len(charts), 2))
         
-        for i, col in enumerate(categorical_cols[:2]):  # Show first 2 categorical columns
-            if df[col].nunique() <= 15:  # Only show if not too many unique values
-                with chart_cols[i % 2]:
-                    st.markdown(f"**{col.replace('_', ' ').title()} Distribution:**")
-                    value_counts = df[col].value_counts().head(10)
-                    st.bar_chart(value_counts)
-            elif i == 0:  # Show first column even if many values
-                with chart_cols[0]:
-                    st.markdown(f"**{col.replace('_', ' ').title()} (Top 10):**")
-                    value_counts = df[col].value_counts().head(10)
-                    st.bar_chart(value_counts)
+        for slot, title, value_counts in charts:
+            with chart_cols[min(slot, len(chart_cols) - 1)]:
+                st.markdown(f"**{title}**")
+                st.bar_chart(value_counts)
 
 def main():
     """Main Streamlit application."""
@@ -518,7 +657,7 @@ def main():
     st.markdown('<p class="sub-header">Ask questions about your web activity and GitHub data in natural language!</p>', unsafe_allow_html=True)
     
     # Initialize client
-    client = AgentClient(API_BASE_URL)
+    client = get_agent_client(API_BASE_URL)
     
     # Sidebar
     with st.sidebar:
@@ -526,8 +665,11 @@ def main():
         
         st.markdown("## 🔧 System Status")
         
-        # Health check
-        health_status = client.get_health_status()
+        if st.button("🔄 Refresh status"):
+            _cached_health.clear()
+        
+        # Health check (cached between reruns)
+        health_status = _cached_health(API_BASE_URL)
         if health_status.get("status") == "healthy":
             st.markdown('<p class="status-online">✅ System Online</p>', unsafe_allow_html=True)
             st.info(f"🤖 Agent: {health_status.get('agent', 'Unknown')}")
@@ -543,7 +685,7 @@ def main():
         
         # Example queries
         st.markdown("## 💡 Example Questions")
-        examples = client.get_examples()
+        examples = _cached_examples(API_BASE_URL)
         
         if examples:
             for i, example in enumerate(examples[:5]):  # Show first 5 examples
@@ -570,6 +712,7 @@ def main():
         # Clear chat button
         if st.button("🗑️ Clear Chat History"):
             if 'chat_history' in st.session_state:
+                _clear_paged_results(st.session_state.chat_history)
                 del st.session_state.chat_history
             st.rerun()
         
@@ -595,8 +738,13 @@ def main():
             if not message['is_user'] and message.get('sql_query'):
                 display_sql_query(message['sql_query'])
             
-            if not message['is_user'] and message.get('results'):
-                display_results(message['results'], message.get('question', ''))
+            results = message.get('results')
+            if not message['is_user'] and isinstance(results, dict) and results.get('_paged'):
+                # Paged-out results are only read back from disk when requested
+                if st.toggle(f"📊 Show {results['rows']} earlier results", key=results['path']):
+                    display_results(_load_paged_results(results['path']), message.get('question', ''))
+            elif not message['is_user'] and results:
+                display_results(results, message.get('question', ''))
     else:
         st.markdown("👋 Welcome! Ask me anything about your web activity and GitHub data.")
         st.markdown("💡 Try asking: *'How much time did I spend on YouTube today?'*")
@@ -665,6 +813,9 @@ def main():
             # Display error message
             st.error(f"❌ Error: {error_msg}")
         
+        # Bound session memory by paging out results of older answers
+        _page_out_history(st.session_state.chat_history)
+        
         # Rerun to update display
         st.rerun()
     